@@ -1,13 +1,30 @@
+import argparse
+import asyncio
+import base64
+import functools
 import os
+import re
+import signal
+import sys
+import uuid
+import httpx
+import openai
 from dotenv import load_dotenv
 import subprocess
-from typing import Optional
+from dataclasses import dataclass
+from typing import List, Optional, Union
 from langchain_openai import ChatOpenAI
+from prompt_toolkit import PromptSession
 from langchain.agents import AgentExecutor
+from langchain.globals import set_llm_cache
+from langchain_community.cache import SQLiteCache
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.tools import tool
+from langchain_core.callbacks import AsyncCallbackManagerForToolRun
+from langchain_core.tracers.langchain import wait_for_all_tracers
 from langsmith import traceable
 from langchain_community.tools.shell.tool import ShellTool
+from pydantic import PrivateAttr
 from langchain.agents.format_scratchpad.openai_tools import (
     format_to_openai_tool_messages,
 )
@@ -15,14 +32,54 @@ from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputP
 
 load_dotenv()
 
-os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
-os.environ["LANGCHAIN_API_KEY"] = os.getenv("LANGCHAIN_API_KEY")
-os.environ["LANGCHAIN_TRACING_V2"] = os.getenv("LANGCHAIN_TRACING_V2")
-os.environ["LANGCHAIN_PROJECT"] = os.getenv("LANGCHAIN_PROJECT")
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    openai_api_key: str
+    langchain_api_key: Optional[str]
+    langchain_project: Optional[str]
+    tracing: bool
+
+    @classmethod
+    def from_env(cls):
+        openai_api_key = os.getenv("OPENAI_API_KEY")
+        if not openai_api_key:
+            raise RuntimeError("OPENAI_API_KEY is not set, see .env.sample")
+        tracing = os.getenv("LANGCHAIN_TRACING_V2", "").lower() == "true"
+        langchain_api_key = os.getenv("LANGCHAIN_API_KEY")
+        if tracing and not langchain_api_key:
+            raise RuntimeError("LANGCHAIN_TRACING_V2 is true but LANGCHAIN_API_KEY is not set")
+        return cls(
+            openai_api_key=openai_api_key,
+            langchain_api_key=langchain_api_key,
+            langchain_project=os.getenv("LANGCHAIN_PROJECT"),
+            tracing=tracing,
+        )
+
+
+config = Config.from_env()
+
+# Tracing is opt-in; pending runs are drained with wait_for_all_tracers on exit.
+if config.tracing:
+    os.environ.update({
+        "LANGCHAIN_TRACING_V2": "true",
+        "LANGCHAIN_API_KEY": config.langchain_api_key,
+        "LANGCHAIN_PROJECT": config.langchain_project or "default",
+    })
+else:
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
 
 ROOT_DIR = "./"
 VALID_FILE_TYPES = {"py", "md", "coffee", "sql", "js"}
 
+_SELECT_RE = re.compile(
+    r"select\s*(?P<columns>.*?)\s*\bfrom\s+(?P<table>[^\s;]+)(?P<rest>.*)",
+    re.S,
+)
+# Searched in the text after the table so aliases and joins do not hide it.
+_WHERE_RE = re.compile(r"\swhere\s+(?P<conditions>.*)", re.S)
+_WHERE_TEMPLATE = ".{method} '{column}', '{operator}', {value}"
+
 @tool
 def sql_to_knex_coffeescript(sql_query: str) -> str:
     """
@@ -32,22 +89,27 @@ def sql_to_knex_coffeescript(sql_query: str) -> str:
     Returns:
     str: The equivalent Knex.js query in CoffeeScript.
     """
+    return _sql_to_knex(sql_query)
+
+@functools.lru_cache(maxsize=1024)
+def _sql_to_knex(sql_query: str) -> str:
     try:
         sql_query = sql_query.strip().lower()
-        if sql_query.startswith("select"):
-            select_part = sql_query.split("from")[0].replace("select", "").strip()
-            table_part = sql_query.split("from")[1].strip().split(" ")[0]
-
-            where_clause = []
-            if "where" in sql_query:
-                where_part = sql_query.split("where")[1].strip()
-                conditions = where_part.split()
+        match = _SELECT_RE.match(sql_query)
+        if match:
+            select_part = match["columns"]
+            table_part = match["table"]
+
+            parts = [f"knex '{table_part}'", f".select '{select_part}'"]
+            where = _WHERE_RE.search(match["rest"])
+            if where:
+                conditions = where["conditions"].rstrip(" ;").split()
                 current_operator = "where"
                 for i in range(0, len(conditions), 4):
                     if i > 0:
-                        if conditions[i-1].lower() == "and":
+                        if conditions[i-1] == "and":
                             current_operator = "andWhere"
-                        elif conditions[i-1].lower() == "or":
+                        elif conditions[i-1] == "or":
                             current_operator = "orWhere"
                     column, operator, value = conditions[i:i+3]
 
@@ -58,24 +120,137 @@ def sql_to_knex_coffeescript(sql_query: str) -> str:
                     else:
                         formatted_value = f"'{value}'"
 
-                    where_clause.append(f".{current_operator} '{column}', '{operator}', {formatted_value}")
+                    parts.append(_WHERE_TEMPLATE.format_map({
+                        "method": current_operator,
+                        "column": column,
+                        "operator": operator,
+                        "value": formatted_value,
+                    }))
 
-            knex_query = f"knex '{table_part}'\n.select '{select_part}'"
-            for clause in where_clause:
-                knex_query += f"\n{clause}"
-
-            return f"{knex_query}\n"
+            return "\n".join(parts) + "\n"
         else:
             return "Only basic SELECT queries are supported in this example."
     except Exception as e:
         return f"An error occurred while transforming SQL to Knex.js: {e}"
 
+class PersistentShellTool(ShellTool):
+    """
+    ShellTool that runs every command in one long-lived bash process instead of
+    starting a new shell per call. Calls are serialized by a lock, so the
+    confirmation prompt and the shell state (cwd, variables) are never shared
+    between two commands at once.
+    """
+    _shell: Optional[asyncio.subprocess.Process] = PrivateAttr(default=None)
+    _lock: asyncio.Lock = PrivateAttr(default_factory=asyncio.Lock)
+
+    async def _arun(
+        self,
+        commands: Union[str, List[str]],
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+    ) -> str:
+        if sys.platform == "win32":
+            return await super()._arun(commands, run_manager=run_manager)
+        if isinstance(commands, str):
+            commands = [commands]
+        async with self._lock:
+            print(f"Executing command:\n {commands}")
+            if self.ask_human_input:
+                answer = await PromptSession().prompt_async(
+                    "Proceed with command execution? (y/n): "
+                )
+                if answer.lower() != "y":
+                    return "User aborted command execution."
+            return await self._execute("\n".join(commands))
+
+    async def _execute(self, script: str) -> str:
+        if self._shell is None:
+            self._shell = await asyncio.create_subprocess_exec(
+                "/bin/bash",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                # Own process group, so background jobs can be killed with it.
+                start_new_session=True,
+            )
+        # The script is passed base64-encoded to eval so unbalanced quotes or
+        # syntax errors cannot swallow the end-of-output sentinel.
+        encoded = base64.b64encode(script.encode()).decode()
+        sentinel = f"__END_{uuid.uuid4().hex}__"
+        # The sentinel is printed after an extra newline so it is found even when
+        # the command's output does not end in one; that newline is stripped below.
+        marker = f"\n{sentinel}\n".encode()
+        buffer = bytearray()
+        try:
+            self._shell.stdin.write(
+                f'eval "$(printf %s {encoded} | base64 -d)" < /dev/null\n'
+                f"printf '\\n%s\\n' {sentinel}\n".encode()
+            )
+            await self._shell.stdin.drain()
+
+            # Output is read in chunks rather than lines, so a single long line
+            # cannot overrun the StreamReader limit.
+            searched = 0
+            while (end := buffer.find(marker, searched)) == -1:
+                chunk = await self._shell.stdout.read(65536)
+                if not chunk:
+                    # The script exited the shell; start a fresh one on the next call.
+                    await self._shell.wait()
+                    self._shell = None
+                    end = len(buffer)
+                    break
+                searched = max(len(buffer) - len(marker) + 1, 0)
+                buffer += chunk
+        except BaseException:
+            # A failed or cancelled read leaves unread output in the pipe that
+            # would leak into the next command, so the shell is discarded.
+            self._kill()
+            raise
+        return buffer[:end].decode(errors="replace").strip()
+
+    def _kill(self):
+        if self._shell is not None:
+            try:
+                os.killpg(self._shell.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self._shell = None
+
+    async def aclose(self, timeout: float = 2.0):
+        if self._shell is None:
+            return
+        self._shell.stdin.close()
+        try:
+            # Background jobs keep the stdout pipe open, so wait() would block
+            # until they finish; give up on them after a short grace period.
+            await asyncio.wait_for(self._shell.wait(), timeout)
+        except asyncio.TimeoutError:
+            self._kill()
+        self._shell = None
+
+shell_tool = PersistentShellTool(ask_human_input=True)
+
 tools = [
     sql_to_knex_coffeescript,
-    ShellTool(ask_human_input=True),
+    shell_tool,
 ]
 
-llm = ChatOpenAI(model="gpt-4o", temperature=0)
+set_llm_cache(SQLiteCache(database_path=".llm_cache.db"))
+
+http_client = httpx.AsyncClient(
+    # Idle connections are kept for two minutes so the one opened by warm_up()
+    # is still alive when a slow typist submits the prompt.
+    limits=httpx.Limits(
+        max_connections=64, max_keepalive_connections=32, keepalive_expiry=120.0
+    )
+)
+
+llm = ChatOpenAI(
+    model="gpt-4o",
+    temperature=0,
+    api_key=config.openai_api_key,
+    http_async_client=http_client,
+)
+openai_client = openai.AsyncOpenAI(api_key=config.openai_api_key, http_client=http_client)
 
 prompt = ChatPromptTemplate.from_messages(
     [
@@ -104,6 +279,98 @@ agent = (
 
 agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
 
-while True:
-    user_prompt = input("Prompt: ")
-    list(agent_executor.stream({"input": user_prompt}))
+
+async def warm_up():
+    # A free models request opens the TLS connection to OpenAI while the user is
+    # still typing, so the first agent call does not pay for the handshake.
+    try:
+        await openai_client.models.list()
+    except openai.OpenAIError:
+        pass
+
+
+async def run_agents():
+    # AgentExecutor already fans out multi-tool turns with asyncio.gather on the
+    # async path; the shell tool runs natively async and the SQL converter runs
+    # in the default executor.
+    session = PromptSession()
+    while True:
+        warm_up_task = asyncio.create_task(warm_up())
+        user_prompt = await session.prompt_async("Prompt: ")
+        # Once the prompt is in, the warm-up has done its job or is too late.
+        warm_up_task.cancel()
+        await agent_executor.ainvoke({"input": user_prompt})
+
+
+async def run_batch(prompts, batch_size=10, delay=0.0, max_concurrency=10):
+    """
+    Runs a list of prompts through the agent concurrently.
+    Parameters:
+    prompts (list[str]): The prompts to run.
+    batch_size (int): How many prompts are sent per batch.
+    delay (float): Seconds to wait between batches.
+    max_concurrency (int): How many prompts of a batch run at the same time.
+    Returns:
+    list[dict | Exception]: The agent outputs, in the same order as the
+    prompts. A prompt that failed is returned as its exception.
+    """
+    results = []
+    for start in range(0, len(prompts), batch_size):
+        if start and delay:
+            await asyncio.sleep(delay)
+        inputs = [{"input": p} for p in prompts[start:start + batch_size]]
+        results.extend(
+            await agent_executor.abatch(
+                inputs,
+                config={"max_concurrency": max_concurrency},
+                return_exceptions=True,
+            )
+        )
+    return results
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Coder agent")
+    parser.add_argument("--batch", metavar="FILE", help="run every non-empty line of FILE as a prompt")
+    parser.add_argument("--batch-size", type=positive_int, default=10)
+    parser.add_argument("--batch-delay", type=float, default=0.0)
+    parser.add_argument("--max-concurrency", type=positive_int, default=10)
+    return parser.parse_args()
+
+
+async def main(args):
+    try:
+        if args.batch:
+            with open(args.batch, encoding="utf-8") as f:
+                prompts = [line.strip() for line in f if line.strip()]
+            results = await run_batch(
+                prompts, args.batch_size, args.batch_delay, args.max_concurrency
+            )
+            for prompt, result in zip(prompts, results):
+                if isinstance(result, Exception):
+                    print(f"Prompt: {prompt}\nError: {result!r}\n")
+                else:
+                    print(f"Prompt: {prompt}\n{result['output']}\n")
+        else:
+            await run_agents()
+    finally:
+        await shell_tool.aclose()
+        await http_client.aclose()
+        if config.tracing:
+            wait_for_all_tracers()
+
+
+if __name__ == "__main__":
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    asyncio.run(main(parse_args()))